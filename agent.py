@@ -1,19 +1,32 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict
 from enum import Enum
+from langchain_core.messages import SystemMessage
 from langchain_core.tools import tool
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.prebuilt import create_react_agent
 
 load_dotenv()
 
+# Identical prompts (temperature=0) are answered from memory instead of re-calling Gemini;
+# bounded so long-running processes do not keep every prompt forever
+set_llm_cache(InMemoryCache(maxsize=int(os.getenv("LLM_CACHE_SIZE", "1000"))))
 
 llm = ChatGoogleGenerativeAI(
     model="gemini-2.5-flash",
     google_api_key=os.getenv("GOOGLE_API_KEY"),
     temperature=0,
+    # The assessment is short and deterministic, so cap decoding and skip extended thinking
+    max_output_tokens=512,
+    thinking_budget=0,
+    # Transient errors (429, 503, timeouts, 500) are retried by the API layer with backoff
+    max_retries=1,
 )
 
 
@@ -26,6 +39,8 @@ class RiskLevel(str, Enum):
 
 
 class ChangeRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     change_id: str
     description: str
     affected_systems: List[str]
@@ -34,10 +49,12 @@ class ChangeRequest(BaseModel):
     has_rollback_plan: bool
     testing_completed: bool
     service_outage_required: bool
-    outage_duration_minutes: Optional[int] = 0
+    outage_duration_minutes: Optional[int] = Field(default=0, ge=0)
 
 
 class RiskAssessment(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     change_id: str
     risk_level: RiskLevel
     risk_score: int = Field(ge=0, le=100)
@@ -46,64 +63,103 @@ class RiskAssessment(BaseModel):
     approval_required: bool
 
 
-@tool
-def query_historical_changes(query: str) -> str:
-    """Query historical change records to find similar past changes and their success rates.
-    Returns data about similar changes, their outcomes, and patterns."""
-    return """Found 8 similar changes in the last 6 months:
+class RiskScore(BaseModel):
+    """Narrow schema Gemini fills in; the rest of the assessment is derived from it"""
+    model_config = ConfigDict(frozen=True)
+
+    risk_score: int = Field(ge=0, le=100, description="Overall risk score from 0 (no risk) to 100 (critical)")
+    rationale: Optional[str] = Field(default=None, description="One or two sentences justifying the score")
+
+
+# Canned tool reports, shared by the ReAct tools and the inline TOOL_CONTEXT
+HISTORICAL_REPORT = """Found 8 similar changes in the last 6 months:
     - 6 successful (75% success rate)
     - 2 failed due to insufficient testing
     - Average complexity score: 3.2/5
     - Most common risk: database schema changes"""
 
+DEPENDENCY_REPORT = """Dependencies found:
+    - 4 downstream services will be affected
+    - 2 are production-critical systems
+    - Estimated blast radius: 250 users
+    - Recovery Time Objective (RTO): 2 hours"""
+
+SCHEDULE_REPORT = """- No conflicting changes scheduled
+    - Outside of monthly blackout period
+    - Maintenance window available: 2 AM - 6 AM IST
+    - Business impact window: LOW"""
+
+RISK_SCORE_REPORT = """Risk Score Calculation:
+    - Complexity: 15/25 (moderate)
+    - Testing: 20/25 (adequate)
+    - Historical: 15/20 (good track record)
+    - Impact: 18/25 (significant but manageable)
+    - Rollback: 8/10 (plan exists)
+    Total Score: 76/100 (HIGH RISK)"""
+
+
+@tool
+async def query_historical_changes(query: str) -> str:
+    """Query historical change records to find similar past changes and their success rates.
+    Returns data about similar changes, their outcomes, and patterns."""
+    return HISTORICAL_REPORT
+
 
 @tool
-def check_configuration_items(systems: str) -> str:
+async def check_configuration_items(systems: str) -> str:
     """Check Configuration Management Database for affected systems and their dependencies.
     Returns information about dependent services, criticality, and downstream impacts.
     """
     return f"""Systems: {systems}
-    Dependencies found:
-    - 4 downstream services will be affected
-    - 2 are production-critical systems
-    - Estimated blast radius: 250 users
-    - Recovery Time Objective (RTO): 2 hours"""
+    {DEPENDENCY_REPORT}"""
 
 
 @tool
-def detect_conflicts(implementation_date: str) -> str:
+async def detect_conflicts(implementation_date: str) -> str:
     """Detect scheduling conflicts with other planned changes or maintenance windows.
     Returns information about overlapping changes and blackout periods."""
     return f"""Date analysis for {implementation_date}:
-    - No conflicting changes scheduled
-    - Outside of monthly blackout period
-    - Maintenance window available: 2 AM - 6 AM IST
-    - Business impact window: LOW"""
+    {SCHEDULE_REPORT}"""
 
 
 @tool
-def calculate_risk_score(change_data: str) -> str:
+async def calculate_risk_score(change_data: str) -> str:
     """Calculate numerical risk score based on multiple weighted factors.
     Returns detailed scoring breakdown and justification."""
-    return """Risk Score Calculation:
-    - Complexity: 15/25 (moderate)
-    - Testing: 20/25 (adequate)
-    - Historical: 15/20 (good track record)
-    - Impact: 18/25 (significant but manageable)
-    - Rollback: 8/10 (plan exists)
-    Total Score: 76/100 (HIGH RISK)"""
+    return RISK_SCORE_REPORT
+
 
 
+class BatchInput(BaseModel):
+    query: str = Field(description="Search query for similar historical changes")
+    systems: str = Field(description="Comma-separated list of affected systems")
+    implementation_date: str = Field(description="Planned implementation date")
+    change_data: str = Field(description="Summary of the change attributes used for scoring")
 
-tools = [
-    query_historical_changes,
-    check_configuration_items,
-    detect_conflicts,
-    calculate_risk_score,
-]
 
+@tool(args_schema=BatchInput)
+async def batch_gather(query: str, systems: str, implementation_date: str, change_data: str) -> str:
+    """Gather historical changes, configuration dependencies, scheduling conflicts and the
+    weighted risk score in a single call. Returns a JSON object keyed by finding."""
+    historical, configuration, conflicts, risk_score = await asyncio.gather(
+        query_historical_changes.ainvoke({"query": query}),
+        check_configuration_items.ainvoke({"systems": systems}),
+        detect_conflicts.ainvoke({"implementation_date": implementation_date}),
+        calculate_risk_score.ainvoke({"change_data": change_data}),
+    )
+    return json.dumps({
+        "historical_changes": historical,
+        "configuration_items": configuration,
+        "conflicts": conflicts,
+        "risk_score": risk_score,
+    })
 
-system_prompt = """You are an expert Change Risk Management Analyst AI with deep expertise in IT operations and risk assessment.
+
+# The sub-tools are independent, so expose them as one call to avoid serial tool turns
+tools = [batch_gather]
+
+
+ANALYST_PROMPT = """You are an expert Change Risk Management Analyst AI with deep expertise in IT operations and risk assessment.
 
 Your task is to analyze change requests and provide comprehensive risk assessments by:
 1. Querying historical data for similar changes
@@ -123,12 +179,41 @@ RISK LEVELS:
 - LOW (0-25): Routine change, minimal impact
 - MODERATE (26-50): Standard change with some risk
 - HIGH (51-75): Complex change requiring approval
-- CRITICAL (76-100): High-risk change requiring CAB review
+- CRITICAL (76-100): High-risk change requiring CAB review"""
+
+system_prompt = f"""{ANALYST_PROMPT}
+
+Call the batch_gather tool exactly once with all of its arguments to gather information, then provide comprehensive analysis."""
+
+# Tool findings inlined for the single-call structured path
+TOOL_CONTEXT = f"""TOOL FINDINGS:
+
+Historical Changes:
+    {HISTORICAL_REPORT}
 
-Use the available tools to gather information and provide comprehensive analysis."""
+Configuration Items:
+    {DEPENDENCY_REPORT}
 
+Scheduling Conflicts:
+    {SCHEDULE_REPORT}
+
+{RISK_SCORE_REPORT}"""
+
+structured_system_prompt = f"""{ANALYST_PROMPT}
+
+{TOOL_CONTEXT}
+
+Use these findings to score the change request from 0 to 100 against the risk levels above."""
+
+# The agent prepends the system message itself, so callers send only the user turn
 agent_executor = create_react_agent(
     model=llm,
     tools=tools,
-    prompt=system_prompt,
+    prompt=SystemMessage(content=system_prompt),
 )
+
+# Single-call assessment, used instead of the ReAct loop while tools return canned data
+structured_llm = llm.with_structured_output(RiskScore)
+
+# Same call without the LLM cache, for retrying output that failed validation
+uncached_structured_llm = llm.model_copy(update={"cache": False}).with_structured_output(RiskScore)
@@ -1,115 +1,371 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+import anyio.to_thread
 import asyncio
-from agent import agent_executor, ChangeRequest, RiskAssessment, RiskLevel
-from typing import List
-from langchain_core.messages import SystemMessage
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+import backoff
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+)
+from pydantic import ValidationError
+from agent import (
+    agent_executor,
+    llm,
+    structured_llm,
+    uncached_structured_llm,
+    structured_system_prompt,
+    ChangeRequest,
+    RiskAssessment,
+    RiskLevel,
+    RiskScore,
+)
+from cache import semantic_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable
 import re
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Size the thread pools, warm Gemini and run the cache sweeper for the app's lifetime"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
+    )
+    
+    # Open the Gemini connection and fetch credentials before real traffic
+    try:
+        await asyncio.wait_for(llm.ainvoke("ok"), timeout=WARMUP_TIMEOUT_SECONDS)
+    except Exception:
+        pass
+    
+    cache_sweeper = asyncio.create_task(
+        semantic_cache.sweep_forever(SEMANTIC_CACHE_SWEEP_SECONDS)
+    )
+    try:
+        yield
+    finally:
+        cache_sweeper.cancel()
+        with suppress(asyncio.CancelledError):
+            await cache_sweeper
+
 app = FastAPI(
     title="Change Risk Management Agent API (Powered by Gemini)",
     description="AI-powered change risk analysis using Google Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Comma-separated origin and request-header allow-lists; credentials are only allowed for explicit origins
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+CORS_HEADERS = [header.strip() for header in os.getenv("CORS_HEADERS", "*").split(",") if header.strip()]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_credentials="*" not in CORS_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=CORS_HEADERS,
+    max_age=86400,
 )
 
-# System prompt for the agent
-SYSTEM_PROMPT = """You are an expert Change Risk Management Analyst AI with deep expertise in IT operations and risk assessment.
+# Matches "NN/100" or "score: NN" in the agent's final answer
+_SCORE_RE = re.compile(r'(\d+)/100|score:\s*(\d+)', re.IGNORECASE)
 
-Your task is to analyze change requests and provide comprehensive risk assessments by:
-1. Querying historical data for similar changes
-2. Checking configuration dependencies and impact scope
-3. Detecting scheduling conflicts
-4. Calculating weighted risk scores
-5. Providing actionable recommendations
+# Risk level per 25-point band of the score
+_LEVELS = (RiskLevel.LOW, RiskLevel.MODERATE, RiskLevel.HIGH, RiskLevel.CRITICAL)
 
-RISK ASSESSMENT CRITERIA:
-- Complexity: Team count, technical difficulty, scope
-- Historical Success: Past performance of similar changes
-- Testing Coverage: Quality and extent of validation
-- Service Impact: Downtime, user impact, criticality
-- Mitigation: Rollback plans and safety measures
+# Recommendations paired with the condition that triggers them, in output order
+_REC_RULES = (
+    (lambda c: not c.testing_completed, "Complete comprehensive testing before implementation"),
+    (lambda c: not c.has_rollback_plan, "Develop and validate rollback procedure"),
+    (lambda c: c.service_outage_required, "Schedule during off-peak hours (2-6 AM IST)"),
+    (lambda c: c.teams_involved > 3, "Conduct pre-implementation coordination meeting"),
+)
+_MONITORING_REC = "Monitor key metrics for 24 hours post-deployment"
 
-RISK LEVELS:
-- LOW (0-25): Routine change, minimal impact
-- MODERATE (26-50): Standard change with some risk
-- HIGH (51-75): Complex change requiring approval
-- CRITICAL (76-100): High-risk change requiring CAB review
+# Heuristic scores in this range are ambiguous and still go to Gemini
+_AMBIGUOUS_SCORES = (40, 65)
 
-Use the available tools to gather information and provide comprehensive analysis."""
+# Scores the deterministic LOW and CRITICAL rules clamp to
+_LOW_SCORE_CEILING = 24
+_CRITICAL_SCORE_FLOOR = 76
 
-@app.post("/api/analyze-change", response_model=RiskAssessment)
-async def analyze_change_risk(change: ChangeRequest) -> RiskAssessment:
-    """Analyze change request using Gemini AI agent"""
-    try:
-        query = f"""Analyze this IT change request comprehensively:
+# Prompt labels indexed by the boolean attribute they describe
+_TESTING_STATUS = ("✗ Not Completed", "✓ Completed")
+_ROLLBACK_STATUS = ("✗ Missing", "✓ Available")
 
-CHANGE DETAILS:
-- Change ID: {change.change_id}
-- Description: {change.description}
-- Affected Systems: {', '.join(change.affected_systems)}
-- Implementation Date: {change.implementation_date}
+# Worker threads for sync handlers, dependencies and any blocking work offloaded from the
+# event loop. The Gemini path is fully async, so this is kept as a tuning knob; past a
+# point larger pools only add GIL and scheduling contention.
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "100"))
 
-CHANGE ATTRIBUTES:
-- Teams Involved: {change.teams_involved}
-- Testing Status: {'✓ Completed' if change.testing_completed else '✗ Not Completed'}
-- Rollback Plan: {'✓ Available' if change.has_rollback_plan else '✗ Missing'}
-- Service Outage: {'Required ({} min)'.format(change.outage_duration_minutes) if change.service_outage_required else 'Not Required'}
+# Longest the startup warm-up call may delay serving
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
 
-Provide a thorough risk assessment."""
-        
-        result = await asyncio.to_thread(
-            agent_executor.invoke,
+# How often expired semantic cache entries are evicted
+SEMANTIC_CACHE_SWEEP_SECONDS = float(os.getenv("SEMANTIC_CACHE_SWEEP_SECONDS", "300"))
+
+# Route requests through the ReAct tool loop instead of the single structured call
+USE_REACT_AGENT = os.getenv("USE_REACT_AGENT", "false").lower() == "true"
+
+# Upper bound on concurrent assessments within a single batch request
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "10"))
+
+# Largest batch accepted by /api/analyze-change-batch
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+
+# Attempts per Gemini call when the provider answers with a transient error, and the
+# exponential backoff base between them (jittered delays of up to 1s, 2s, 4s, ...)
+_GEMINI_TRIES = 5
+_GEMINI_BACKOFF_BASE = 2
+
+# Provider errors worth retrying: rate limits, overload, timeouts and transient 500s
+_RETRYABLE_ERRORS = (ResourceExhausted, ServiceUnavailable, DeadlineExceeded, InternalServerError)
+
+# Caps in-flight Gemini calls across all endpoints to stay within the provider's rate limits
+_GEMINI_SEM = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")))
+
+# Built once so every structured call shares the same, byte-identical prompt prefix
+_STRUCTURED_SYSTEM_MSG = SystemMessage(content=structured_system_prompt)
+
+def build_query(change: ChangeRequest) -> str:
+    """Build the user prompt describing a change request"""
+    systems = ", ".join(change.affected_systems)
+    outage = (
+        f"Required ({change.outage_duration_minutes} min)"
+        if change.service_outage_required else "Not Required"
+    )
+    parts = (
+        "Analyze this IT change request comprehensively:",
+        "",
+        "CHANGE DETAILS:",
+        f"- Change ID: {change.change_id}",
+        f"- Description: {change.description}",
+        f"- Affected Systems: {systems}",
+        f"- Implementation Date: {change.implementation_date}",
+        "",
+        "CHANGE ATTRIBUTES:",
+        f"- Teams Involved: {change.teams_involved}",
+        f"- Testing Status: {_TESTING_STATUS[int(change.testing_completed)]}",
+        f"- Rollback Plan: {_ROLLBACK_STATUS[int(change.has_rollback_plan)]}",
+        f"- Service Outage: {outage}",
+        "",
+        "Provide a thorough risk assessment.",
+    )
+    return "\n".join(parts)
+
+def finalize_assessment(result: Optional[RiskScore], change: ChangeRequest) -> RiskAssessment:
+    """Turn Gemini's structured score into a full assessment using the deterministic rules"""
+    if result is None:
+        raise ValueError("Gemini returned no structured risk score")
+    return build_assessment(change, result.risk_score, extract_recommendations(change))
+
+@backoff.on_exception(backoff.expo, _RETRYABLE_ERRORS, max_tries=_GEMINI_TRIES, base=_GEMINI_BACKOFF_BASE, factor=1)
+async def invoke_gemini(runnable: Runnable, payload: Any, retry_runnable: Optional[Runnable] = None) -> Any:
+    """Invoke a Gemini-backed runnable under the shared concurrency limit.
+
+    Rate-limit and other transient provider errors are retried with exponential
+    backoff. Malformed structured output is retried once, immediately, through
+    retry_runnable, which must bypass the LLM cache or it would replay the same
+    cached generation.
+    """
+    async with _GEMINI_SEM:
+        try:
+            return await runnable.ainvoke(payload)
+        except ValidationError:
+            if retry_runnable is None:
+                raise
+            return await retry_runnable.ainvoke(payload)
+
+async def assess_change(change: ChangeRequest) -> RiskAssessment:
+    """Run a single change request through Gemini"""
+    query = build_query(change)
+    
+    if USE_REACT_AGENT:
+        result = await invoke_gemini(
+            agent_executor,
             {
-                "messages": [
-                    SystemMessage(content=SYSTEM_PROMPT),
-                    ("user", query)
-                ]
+                "messages": [("user", query)]
             }
         )
         
         # Extract the last message content
         output = result["messages"][-1].content
-        assessment = parse_gemini_output(output, change)
+        return parse_gemini_output(output, change)
+    
+    result = await invoke_gemini(structured_llm, [
+        _STRUCTURED_SYSTEM_MSG,
+        HumanMessage(content=query)
+    ], retry_runnable=uncached_structured_llm)
+    return finalize_assessment(result, change)
+
+async def resolve_assessment(change: ChangeRequest) -> RiskAssessment:
+    """Answer from the fast path or semantic cache when possible, otherwise ask Gemini"""
+    assessment = _fast_path(change)
+    if assessment is not None:
         return assessment
+    
+    return await semantic_cache.get_or_compute(change, lambda: assess_change(change))
+
+@app.post("/api/analyze-change", response_model=RiskAssessment)
+async def analyze_change_risk(change: ChangeRequest) -> RiskAssessment:
+    """Analyze change request using Gemini AI agent"""
+    try:
+        return await resolve_assessment(change)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.post("/api/analyze-change-batch", response_model=List[RiskAssessment])
+async def analyze_change_risk_batch(changes: List[ChangeRequest]) -> List[RiskAssessment]:
+    """Analyze multiple change requests concurrently, sharing the global Gemini limit"""
+    if len(changes) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_SIZE} change requests")
+    
+    # Bounds the embedding lookups too, which the Gemini semaphore does not cover
+    batch_sem = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    
+    async def resolve_limited(change: ChangeRequest) -> RiskAssessment:
+        async with batch_sem:
+            return await resolve_assessment(change)
+    
+    try:
+        return await asyncio.gather(*[resolve_limited(change) for change in changes])
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+def _chunk_frames(chunk: Any) -> Iterator[Tuple[str, str]]:
+    """Frames carried by a streamed model chunk: ("text", tokens) and ("tool_call", partial arguments)"""
+    if isinstance(chunk.content, str) and chunk.content:
+        yield "text", chunk.content
+    args = "".join(tool_call.get("args") or "" for tool_call in chunk.tool_call_chunks)
+    if args:
+        yield "tool_call", args
+
+async def stream_gemini(runnable: Runnable, payload: Any, retry_runnable: Optional[Runnable] = None):
+    """Stream a Gemini-backed runnable, yielding ("text" | "tool_call", str) frames and a final ("output", value).
+
+    Mirrors invoke_gemini: transient provider errors are retried with the same jittered
+    exponential backoff as long as nothing has been sent yet, and malformed structured
+    output is recomputed once through retry_runnable.
+    """
+    for attempt in range(_GEMINI_TRIES):
+        sent = False
+        try:
+            async with _GEMINI_SEM:
+                async for ev in runnable.astream_events(payload, version="v2"):
+                    if ev["event"] == "on_chat_model_stream":
+                        for frame in _chunk_frames(ev["data"]["chunk"]):
+                            sent = True
+                            yield frame
+                    elif ev["event"] == "on_chain_end" and not ev["parent_ids"]:
+                        yield "output", ev["data"]["output"]
+            return
+        except _RETRYABLE_ERRORS:
+            if sent or attempt == _GEMINI_TRIES - 1:
+                raise
+            await asyncio.sleep(backoff.full_jitter(_GEMINI_BACKOFF_BASE ** attempt))
+        except ValidationError:
+            if retry_runnable is None:
+                raise
+            yield "output", await invoke_gemini(retry_runnable, payload)
+            return
+
+@app.post("/api/analyze-change/stream")
+async def analyze_change_risk_stream(change: ChangeRequest) -> StreamingResponse:
+    """Stream Gemini output as Server-Sent Events, ending with the structured assessment.
+
+    Fast-path and cached assessments are sent straight away. Model tokens go out as plain
+    data frames and partial function-call arguments as tool_call events; in structured mode
+    Gemini usually emits the arguments in one piece, so incremental output mostly matters
+    with USE_REACT_AGENT=true.
+    """
+    query = build_query(change)
+    
+    if USE_REACT_AGENT:
+        runnable, retry_runnable = agent_executor, None
+        payload = {"messages": [("user", query)]}
+    else:
+        runnable, retry_runnable = structured_llm, uncached_structured_llm
+        payload = [_STRUCTURED_SYSTEM_MSG, HumanMessage(content=query)]
+    
+    async def events():
+        try:
+            vector = None
+            assessment = _fast_path(change)
+            if assessment is None:
+                assessment, vector = await semantic_cache.lookup(change)
+            
+            if assessment is None:
+                output = None
+                async for kind, value in stream_gemini(runnable, payload, retry_runnable):
+                    if kind == "text":
+                        yield f"data: {json.dumps(value)}\n\n"
+                    elif kind == "tool_call":
+                        yield f"event: tool_call\ndata: {json.dumps(value)}\n\n"
+                    else:
+                        output = value
+                
+                if USE_REACT_AGENT:
+                    assessment = parse_gemini_output(output["messages"][-1].content, change)
+                else:
+                    assessment = finalize_assessment(output, change)
+                if vector is not None:
+                    semantic_cache.store(change, vector, assessment)
+            
+            yield f"event: assessment\ndata: {assessment.model_dump_json()}\n\n"
+            
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(f'Error: {str(e)}')}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 def parse_gemini_output(output: str, change: ChangeRequest) -> RiskAssessment:
     """Parse Gemini agent output into structured RiskAssessment"""
-    output_lower = output.lower()
-    
     # Extract risk score
-    risk_score = extract_risk_score(output_lower)
+    risk_score = extract_risk_score(output)
     
-    # Determine risk level
-    if risk_score < 25:
-        risk_level = RiskLevel.LOW
-    elif risk_score < 50:
-        risk_level = RiskLevel.MODERATE
-    elif risk_score < 75:
-        risk_level = RiskLevel.HIGH
-    else:
-        risk_level = RiskLevel.CRITICAL
+    recommendations = extract_recommendations(change)
     
-    risk_factors = {
-        "complexity": "moderate" if change.teams_involved > 2 else "low",
-        "testing_coverage": "adequate" if change.testing_completed else "insufficient",
+    return build_assessment(change, risk_score, recommendations)
+
+@lru_cache(maxsize=8)
+def _risk_factors(teams_gt2: bool, tested: bool, outage: bool) -> Dict[str, str]:
+    """Risk factor breakdown; only eight combinations exist, so each dict is built once"""
+    return {
+        "complexity": "moderate" if teams_gt2 else "low",
+        "testing_coverage": "adequate" if tested else "insufficient",
         "historical_pattern": "favorable",
-        "service_impact": "high" if change.service_outage_required else "low"
+        "service_impact": "high" if outage else "low"
     }
+
+def build_assessment(change: ChangeRequest, risk_score: int, recommendations: List[str]) -> RiskAssessment:
+    """Assemble a RiskAssessment from a risk score and the change attributes"""
+    # model_construct skips the 0-100 bound on risk_score, so enforce it here
+    risk_score = max(0, min(risk_score, 100))
     
-    recommendations = extract_recommendations(output_lower, change)
+    # Determine risk level
+    risk_level = _LEVELS[min(risk_score // 25, 3)]
+    
+    risk_factors = _risk_factors(
+        change.teams_involved > 2,
+        change.testing_completed,
+        change.service_outage_required
+    )
     
-    return RiskAssessment(
+    # Every field is built here from validated inputs, so skip re-validation;
+    # this also lets assessments share the cached, read-only risk_factors dict
+    return RiskAssessment.model_construct(
         change_id=change.change_id,
         risk_level=risk_level,
         risk_score=risk_score,
@@ -118,28 +374,44 @@ def parse_gemini_output(output: str, change: ChangeRequest) -> RiskAssessment:
         approval_required=risk_score > 50
     )
 
+def heuristic_risk_score(change: ChangeRequest) -> int:
+    """Weighted 0-100 risk score computed from the change attributes alone"""
+    outage_minutes = (change.outage_duration_minutes or 0) if change.service_outage_required else 0
+    
+    complexity = min(max(change.teams_involved, 0) * 5, 25)
+    testing = 0 if change.testing_completed else 25
+    historical = 15
+    impact = min(outage_minutes // 10, 25)
+    rollback = 0 if change.has_rollback_plan else 10
+    return complexity + testing + historical + impact + rollback
+
+def _fast_path(change: ChangeRequest) -> Optional[RiskAssessment]:
+    """Assess clear-cut changes without Gemini; None means the case needs the model"""
+    risk_score = heuristic_risk_score(change)
+    
+    # Single-team, tested, reversible changes without an outage are always LOW
+    if (change.teams_involved <= 1 and change.testing_completed
+            and change.has_rollback_plan and not change.service_outage_required):
+        risk_score = min(risk_score, _LOW_SCORE_CEILING)
+    # Long outages across many teams with no way back are always CRITICAL
+    elif (change.service_outage_required and (change.outage_duration_minutes or 0) > 240
+            and change.teams_involved > 5 and not change.has_rollback_plan):
+        risk_score = max(risk_score, _CRITICAL_SCORE_FLOOR)
+    elif _AMBIGUOUS_SCORES[0] <= risk_score <= _AMBIGUOUS_SCORES[1]:
+        return None
+    
+    return build_assessment(change, risk_score, extract_recommendations(change))
+
 def extract_risk_score(output: str) -> int:
     """Extract numerical risk score from agent output"""
-    score_match = re.search(r'(\d+)/100|score:\s*(\d+)', output)
+    score_match = _SCORE_RE.search(output)
     if score_match:
-        return int(score_match.group(1) or score_match.group(2))
+        return min(int(score_match.group(1) or score_match.group(2)), 100)
     return 50
 
-def extract_recommendations(output: str, change: ChangeRequest) -> List[str]:
+def extract_recommendations(change: ChangeRequest) -> List[str]:
     """Extract actionable recommendations"""
-    recommendations = []
-    
-    if not change.testing_completed:
-        recommendations.append("Complete comprehensive testing before implementation")
-    if not change.has_rollback_plan:
-        recommendations.append("Develop and validate rollback procedure")
-    if change.service_outage_required:
-        recommendations.append("Schedule during off-peak hours (2-6 AM IST)")
-    if change.teams_involved > 3:
-        recommendations.append("Conduct pre-implementation coordination meeting")
-    
-    recommendations.append("Monitor key metrics for 24 hours post-deployment")
-    return recommendations
+    return [message for applies, message in _REC_RULES if applies(change)] + [_MONITORING_REC]
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from agent import ChangeRequest, RiskAssessment
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    assessment: RiskAssessment
+    expires_at: float
+
+
+@dataclass
+class VectorBucket:
+    """Embeddings of changes that agree on every decision-driving attribute"""
+    dimensions: int
+    index: faiss.IndexFlatIP = field(init=False)
+    vectors: List[np.ndarray] = field(default_factory=list)
+    entries: List[CacheEntry] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.index = faiss.IndexFlatIP(self.dimensions)
+
+    def add(self, vector: np.ndarray, entry: CacheEntry) -> None:
+        self.index.add(vector)
+        self.vectors.append(vector)
+        self.entries.append(entry)
+
+    def nearest(self, vector: np.ndarray, threshold: float) -> Optional[CacheEntry]:
+        if self.index.ntotal == 0:
+            return None
+        scores, ids = self.index.search(vector, 1)
+        if ids[0][0] < 0 or scores[0][0] < threshold:
+            return None
+        return self.entries[ids[0][0]]
+
+    def evict_expired(self, now: float) -> None:
+        live = [
+            (vector, entry)
+            for vector, entry in zip(self.vectors, self.entries)
+            if entry.expires_at > now
+        ]
+        self.index = faiss.IndexFlatIP(self.dimensions)
+        self.vectors = [vector for vector, _ in live]
+        self.entries = [entry for _, entry in live]
+        if self.vectors:
+            self.index.add(np.vstack(self.vectors))
+
+
+def cache_key(change: ChangeRequest) -> str:
+    """Canonical text for a change request, independent of its change_id"""
+    return "|".join((
+        change.description,
+        ",".join(sorted(change.affected_systems)),
+        change.implementation_date,
+        str(change.teams_involved),
+        str(change.has_rollback_plan),
+        str(change.testing_completed),
+        str(change.service_outage_required),
+        str(change.outage_duration_minutes),
+    ))
+
+
+def bucket_key(change: ChangeRequest) -> Tuple:
+    """Attributes that drive the assessment; only exact matches may share a cached result"""
+    return (
+        change.testing_completed,
+        change.has_rollback_plan,
+        change.service_outage_required,
+        change.teams_involved,
+        change.outage_duration_minutes,
+    )
+
+
+def embedding_text(change: ChangeRequest) -> str:
+    """Free-text part of a change request, compared by embedding similarity"""
+    return "|".join((change.description, ",".join(sorted(change.affected_systems))))
+
+
+class SemanticCache:
+    """In-memory cache of risk assessments keyed by change request embedding"""
+
+    def __init__(
+        self,
+        embeddings: GoogleGenerativeAIEmbeddings,
+        threshold: float = 0.92,
+        ttl_seconds: float = 3600,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._buckets: Dict[Tuple, VectorBucket] = {}
+        self._exact: Dict[str, CacheEntry] = {}
+
+    async def _embed(self, text: str) -> np.ndarray:
+        vector = np.array([await self.embeddings.aembed_query(text)], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    async def lookup(self, change: ChangeRequest) -> Tuple[Optional[RiskAssessment], Optional[np.ndarray]]:
+        """Return a cached assessment for a similar change, plus the embedding to store on a miss.
+
+        The embedding is None when the embeddings call failed; the caller should then
+        compute the assessment without caching it.
+        """
+        now = time.monotonic()
+
+        # Exact match avoids the embedding round-trip entirely
+        entry = self._exact.get(cache_key(change))
+        if entry is None or entry.expires_at <= now:
+            try:
+                vector = await self._embed(embedding_text(change))
+            except Exception:
+                logger.warning("Semantic cache embedding failed; computing uncached", exc_info=True)
+                return None, None
+            bucket = self._buckets.get(bucket_key(change))
+            entry = bucket.nearest(vector, self.threshold) if bucket else None
+            if entry is None or entry.expires_at <= now:
+                return None, vector
+
+        return entry.assessment.model_copy(update={"change_id": change.change_id}), None
+
+    def store(self, change: ChangeRequest, vector: np.ndarray, assessment: RiskAssessment) -> None:
+        key = cache_key(change)
+        entry = CacheEntry(key, assessment, time.monotonic() + self.ttl_seconds)
+        bucket = self._buckets.get(bucket_key(change))
+        if bucket is None:
+            # Sized from the embedding itself, so any embeddings model works without configuration
+            bucket = self._buckets[bucket_key(change)] = VectorBucket(vector.shape[1])
+        bucket.add(vector, entry)
+        self._exact[key] = entry
+
+    async def get_or_compute(
+        self,
+        change: ChangeRequest,
+        compute: Callable[[], Awaitable[RiskAssessment]],
+    ) -> RiskAssessment:
+        """Return a cached assessment for a similar change, or compute and cache a new one"""
+        assessment, vector = await self.lookup(change)
+        if assessment is not None:
+            return assessment
+
+        assessment = await compute()
+        if vector is not None:
+            self.store(change, vector, assessment)
+        return assessment
+
+    def sweep(self) -> None:
+        """Drop expired entries and rebuild the vector indexes"""
+        now = time.monotonic()
+        for key, bucket in list(self._buckets.items()):
+            bucket.evict_expired(now)
+            if not bucket.entries:
+                del self._buckets[key]
+        self._exact = {
+            entry.key: entry
+            for bucket in self._buckets.values()
+            for entry in bucket.entries
+        }
+
+    async def sweep_forever(self, interval_seconds: float) -> None:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            self.sweep()
+
+
+semantic_cache = SemanticCache(
+    GoogleGenerativeAIEmbeddings(
+        model=os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "models/gemini-embedding-001"),
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+    ),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600")),
+)